@@ -0,0 +1,85 @@
+# Cython version of the compiled kernels in cloth.py, so the cloth can run
+# at native speed without waiting for numba to compile. Build it with
+#   python setup.py build_ext --inplace
+cimport cython
+from libc.math cimport sqrtf, fabsf
+
+# relaxes the constraint between particles a and b, which index the
+# flattened particle arrays, and returns how far off it was
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline float _relax(float[:, ::1] X, float[::1] W, unsigned char[::1] sleep,
+                        Py_ssize_t a, Py_ssize_t b, float gap, float k, float wake,
+                        int sleepSteps) noexcept nogil:
+    if sleep[a] >= sleepSteps and sleep[b] >= sleepSteps: return 0
+
+    cdef float dx = X[b, 0] - X[a, 0]
+    cdef float dy = X[b, 1] - X[a, 1]
+    cdef float r_mag = sqrtf(dx*dx + dy*dy)
+    cdef float delta = r_mag - gap
+    if fabsf(delta) > wake * gap:
+        sleep[a] = 0
+        sleep[b] = 0
+
+    # a sleeping particle takes none of the correction
+    cdef float wA = W[a] if sleep[a] < sleepSteps else 0
+    cdef float wB = W[b] if sleep[b] < sleepSteps else 0
+    cdef float s = wA + wB
+    if s == 0: return 0
+
+    cdef float factor = k * delta / (s * r_mag)
+    X[a, 0] += factor * wA * dx
+    X[a, 1] += factor * wA * dy
+    X[b, 0] -= factor * wB * dx
+    X[b, 1] -= factor * wB * dy
+    return fabsf(delta)
+
+# moves every free particle one Verlet step, where g is how far gravity
+# moves a particle in one step, and updates how long each particle has
+# been at rest
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def integrate(float[:, ::1] X, float[:, ::1] Xprev, unsigned char[::1] fixed,
+              unsigned char[::1] sleep, float g, float tol, int sleepSteps):
+    cdef Py_ssize_t a
+    cdef float x, y, vx, vy
+    with nogil:
+        for a in range(X.shape[0]):
+            x = X[a, 0]
+            y = X[a, 1]
+            vx = x - Xprev[a, 0]
+            vy = y - Xprev[a, 1]
+            if vx*vx + vy*vy > tol*tol:
+                sleep[a] = 0
+            elif sleep[a] < sleepSteps:
+                sleep[a] += 1
+
+            if fixed[a]: continue
+            if sleep[a] < sleepSteps:
+                X[a, 0] = x + vx
+                X[a, 1] = y + vy + g
+            Xprev[a, 0] = x
+            Xprev[a, 1] = y
+
+# all Jakobsen iterations, relaxing the constraints one color at a time
+# and stopping early once every constraint is within tol
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def jakobsen(float[:, ::1] X, float[::1] W, unsigned char[::1] sleep, tuple colors,
+             float[::1] gaps, float k, int iters, float tol, float wake, int sleepSteps):
+    cdef Py_ssize_t[:, ::1] edges
+    cdef Py_ssize_t c, e
+    cdef float gap, err, maxErr
+    cdef int it
+    for it in range(iters):
+        maxErr = 0
+        for c in range(len(colors)):
+            edges = colors[c]
+            gap = gaps[c]
+            with nogil:
+                for e in range(edges.shape[0]):
+                    err = _relax(X, W, sleep, edges[e, 0], edges[e, 1], gap, k,
+                                 wake, sleepSteps)
+                    if err > maxErr: maxErr = err
+        if maxErr < tol: break
@@ -1,47 +1,106 @@
 from cmu_graphics import *
 import numpy as np
 
+# the Cython extension (built with setup.py) and numba are both optional,
+# without either the cloth is relaxed with plain NumPy
+try:
+    import _cloth
+except ImportError:
+    _cloth = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 # constants
 G = 1000
 JAKOBSEN_ITERATIONS = 20
 FPS = 100
 DT = 1/FPS
 
+# particles that move less than SLEEP_TOLERANCE of a gap per step for
+# SLEEP_STEPS steps in a row fall asleep: they hold still and constraints
+# between two sleeping particles are skipped, until a constraint on one of
+# them is off by more than WAKE_TOLERANCE of its gap
+SLEEP_TOLERANCE = 1e-3
+WAKE_TOLERANCE = 5e-2
+SLEEP_STEPS = 30
+
+# the Jakobsen iterations stop early once no constraint is off by more
+# than CONVERGENCE_TOLERANCE of a gap
+CONVERGENCE_TOLERANCE = 1e-3
+
 # creates vectors
 def vec(x, y):
     return np.array([x, y])
 
-def distance(x1, x2):
-    r = x2 - x1
-    return np.dot(r, r)**0.5
-
-class Particle:
-
-    def __init__(self, x, r, m):
-        self.m = m
-        self.r = r
-        self.x = x
-        self.xPrev = x
-        self.f = vec(0, 0)
-        self.fixed = False
-
-    # https://en.wikipedia.org/wiki/Verlet_integration
-    def update(self):
-        a = self.f / self.m
-        temp = self.x 
-        self.x = (2 * self.x) - self.xPrev + (a * DT**2)
-        self.xPrev = temp
-
-        self.v = (self.x - self.xPrev) / DT
-        self.f = vec(0, 0)
+if njit is not None:
 
-    def add_gravity(self):
-        gVec = self.m * G * vec(0, 1)
-        self.f += gVec
+    # relaxes the constraint between particles a and b, which index the
+    # flattened particle arrays, and returns how far off it was; like the
+    # NumPy and Cython versions, dividing by a zero length gives NaN
+    # rather than raising
+    @njit(cache=True, fastmath=True, error_model='numpy')
+    def _relax(X, W, sleep, a, b, gap, k, wake, sleepSteps):
+        if sleep[a] >= sleepSteps and sleep[b] >= sleepSteps: return np.float32(0)
 
-    def draw(self):
-        x, y = float(self.x[0]), float(self.x[1])
-        drawCircle(x, y, self.r)
+        dx = X[b, 0] - X[a, 0]
+        dy = X[b, 1] - X[a, 1]
+        r_mag = np.sqrt(dx*dx + dy*dy)
+        delta = r_mag - gap
+        if abs(delta) > wake * gap:
+            sleep[a] = 0
+            sleep[b] = 0
+
+        # a sleeping particle takes none of the correction
+        wA = W[a] if sleep[a] < sleepSteps else np.float32(0)
+        wB = W[b] if sleep[b] < sleepSteps else np.float32(0)
+        s = wA + wB
+        if s == 0: return np.float32(0)
+
+        factor = k * delta / (s * r_mag)
+        X[a, 0] += factor * wA * dx
+        X[a, 1] += factor * wA * dy
+        X[b, 0] -= factor * wB * dx
+        X[b, 1] -= factor * wB * dy
+        return abs(delta)
+
+    # moves every free particle one Verlet step, where g is how far gravity
+    # moves a particle in one step, and updates how long each particle has
+    # been at rest
+    @njit(cache=True, fastmath=True, error_model='numpy')
+    def _integrate(X, Xprev, fixed, sleep, g, tol, sleepSteps):
+        for a in range(X.shape[0]):
+            x, y = X[a, 0], X[a, 1]
+            vx, vy = x - Xprev[a, 0], y - Xprev[a, 1]
+            if vx*vx + vy*vy > tol*tol:
+                sleep[a] = 0
+            elif sleep[a] < sleepSteps:
+                sleep[a] += 1
+
+            if fixed[a]: continue
+            if sleep[a] < sleepSteps:
+                X[a, 0] = x + vx
+                X[a, 1] = y + vy + g
+            Xprev[a, 0] = x
+            Xprev[a, 1] = y
+
+    # all Jakobsen iterations in one compiled call, stopping early once
+    # every constraint is within tol; no two constraints of the same color
+    # share a particle, so each color is relaxed in parallel
+    @njit(cache=True, fastmath=True, error_model='numpy', parallel=True)
+    def _jakobsen(X, W, sleep, colors, gaps, k, iters, tol, wake, sleepSteps):
+        for _ in range(iters):
+            maxErr = np.float32(0)
+            for c in range(len(colors)):
+                edges = colors[c]
+                gap = gaps[c]
+                for e in prange(edges.shape[0]):
+                    err = _relax(X, W, sleep, edges[e, 0], edges[e, 1], gap, k,
+                                 wake, sleepSteps)
+                    maxErr = max(maxErr, err)
+            if maxErr < tol: break
 
 class Cloth:
 
@@ -53,114 +112,172 @@ class Cloth:
         yLength = abs(endY - startY)
         self.xGap = xLength / (num_particles - 1)
         self.yGap = yLength / (num_particles - 1)
-        
-        self.particles = [[None for _ in range(num_particles)] for _ in range(num_particles)]
-        for i in range(num_particles):
-            for j in range(num_particles):
-                posX = startX + i * self.xGap
-                posY = startY + j * self.yGap
-                self.particles[i][j] = Particle(vec(posX, posY), r, m)
 
+        # particle state is stored as contiguous C-order arrays indexed by
+        # [i, j] instead of one object per particle, so every step can walk
+        # the whole grid in memory order; fixed holds 0 or 1 per particle.
+        # float32 is plenty for positions in pixels and halves the memory
+        # the solver has to move
+        n = num_particles
+        self.X = np.empty((n, n, 2), dtype=np.float32, order='C')
+        self.X[..., 0] = startX + np.arange(n)[:, None] * self.xGap
+        self.X[..., 1] = startY + np.arange(n)[None, :] * self.yGap
+        self.Xprev = self.X.copy(order='C')
+        self.m = m
+        self.fixed = np.zeros((n, n), dtype=np.uint8)
+
+        # the share of a constraint's correction each particle takes, its
+        # inverse mass, or 0 while it is fixed, kept up to date by setFixed
+        # so the solver never has to look at fixed
+        self.W = np.full((n, n, 1), 1 / m, dtype=np.float32)
+
+        # how many steps in a row each particle has been at rest, up to
+        # SLEEP_STEPS, at which point it is asleep
+        self.sleep = np.zeros((n, n), dtype=np.uint8)
+        self.sleepTol = np.float32(SLEEP_TOLERANCE * min(self.xGap, self.yGap))
+        self.wakeTol = np.float32(WAKE_TOLERANCE)
+        self.convergeTol = np.float32(CONVERGENCE_TOLERANCE * min(self.xGap, self.yGap))
+
+        # the constraints are split into four colors (vertical ones starting
+        # at an even or odd i, horizontal ones at an even or odd j) so that
+        # no two constraints of the same color share a particle
+        every = slice(None)
+        even, evenNext = slice(0, -1, 2), slice(1, None, 2)
+        odd, oddNext = slice(1, -1, 2), slice(2, None, 2)
+        self.colors = [
+            ((even, every), (evenNext, every), self.yGap),
+            ((odd, every), (oddNext, every), self.yGap),
+            ((every, even), (every, evenNext), self.xGap),
+            ((every, odd), (every, oddNext), self.xGap),
+        ]
+
+        # the same colors as pairs of indices into the flattened grid
+        index = np.arange(n * n, dtype=np.intp).reshape(n, n)
+        self.colorEdges = tuple(np.stack([index[v].ravel(), index[w].ravel()], axis=1)
+                                for v, w, _ in self.colors)
+        self.colorGaps = np.array([gap for _, _, gap in self.colors], dtype=np.float32)
+
+        self.r = r
         self.stiffness = stiffness
 
+        # fraction of the error corrected per iteration, the same for every
+        # constraint, so it is worked out once here; corrections have always
+        # been scaled by 1/m, and every particle has the same mass, so that
+        # is folded in too
+        self.k = np.float32((1 - (1 - stiffness)**JAKOBSEN_ITERATIONS) / m)
+
+        # how far gravity moves a particle in one step
+        self.g = np.float32(G * DT**2)
+
     def closest(self, x):
-        minDist = None
-        minPos = None
-
-        rows = len(self.particles)
-        cols = len(self.particles[0])
-        for i in range(rows):
-            for j in range(cols):
-                particle = self.particles[i][j]
-                dist = distance(x, particle.x)
-                if minDist == None or dist < minDist:
-                    minDist = dist
-                    minPos = i, j
-        return minPos
+        r = self.X - x
+        dist = (r * r).sum(-1)
+        i, j = np.unravel_index(np.argmin(dist), dist.shape)
+        return int(i), int(j)
     
     def setFixed(self, i, j):
-        if i < 0 or i >= len(self.particles): return
-        if j < 0 or j >= len(self.particles[0]): return
-        self.particles[i][j].fixed = not self.particles[i][j].fixed
+        if i < 0 or i >= self.fixed.shape[0]: return
+        if j < 0 or j >= self.fixed.shape[1]: return
+        self.fixed[i, j] = 1 - self.fixed[i, j]
+
+        # sleeping particles were only at rest for the old constraints, so
+        # any change to the cloth wakes all of it
+        self.sleep.fill(0)
+        self.W[i, j] = 0 if self.fixed[i, j] else 1 / self.m
 
     def setPosition(self, i, j, pos):
-        if i < 0 or i >= len(self.particles): return
-        if j < 0 or j >= len(self.particles[0]): return
-        self.particles[i][j].x = pos
+        if i < 0 or i >= self.fixed.shape[0]: return
+        if j < 0 or j >= self.fixed.shape[1]: return
+        self.X[i, j] = pos
+        self.sleep.fill(0)
     
     def draw(self):
-        rows = len(self.particles)
-        cols = len(self.particles[0])
-        for i in range(rows):
-            for j in range(cols):
-                particle = self.particles[i][j]
-                if particle.fixed: particle.draw()
-
-        
-        for i in range(rows - 1):
-            for j in range(cols):
-                startX, startY = self.particles[i][j].x
-                endX, endY = self.particles[i+1][j].x
-                drawLine(float(startX), float(startY), float(endX), float(endY))
-
-        for i in range(rows):
-            for j in range(cols - 1):
-                startX, startY = self.particles[i][j].x
-                endX, endY = self.particles[i][j+1].x
-                drawLine(float(startX), float(startY), float(endX), float(endY))
-
-    def add_gravity(self):
-        rows = len(self.particles)
-        cols = len(self.particles[0])
-        for i in range(rows):
-            for j in range(cols):
-                particle = self.particles[i][j]
-                particle.add_gravity()
-    
+        for x, y in self.X[self.fixed == 1].tolist():
+            drawCircle(x, y, self.r)
+
+        # each row and column of the mesh is turned into plain floats in one
+        # tolist() call, then drawn segment by segment
+        rows, cols = self.fixed.shape
+        lines = [self.X[:, j] for j in range(cols)] + [self.X[i] for i in range(rows)]
+        for line in lines:
+            points = line.tolist()
+            for k in range(len(points)-1):
+                drawLine(points[k][0], points[k][1], points[k+1][0], points[k+1][1])
+
+    # gravity is the only force on the cloth and pulls every particle the
+    # same way, so it is folded straight into the Verlet update
+    # https://en.wikipedia.org/wiki/Verlet_integration
     def update(self):
-        rows = len(self.particles)
-        cols = len(self.particles[0])
-        for i in range(rows):
-            for j in range(cols):
-                particle = self.particles[i][j]
-                if not particle.fixed:
-                    particle.update()
-
+        if _cloth is not None:
+            _cloth.integrate(self.X.reshape(-1, 2), self.Xprev.reshape(-1, 2),
+                             self.fixed.reshape(-1), self.sleep.reshape(-1),
+                             self.g, self.sleepTol, SLEEP_STEPS)
+            return
+        if njit is not None:
+            _integrate(self.X.reshape(-1, 2), self.Xprev.reshape(-1, 2),
+                       self.fixed.reshape(-1), self.sleep.reshape(-1),
+                       self.g, self.sleepTol, SLEEP_STEPS)
+            return
+
+        v = self.X - self.Xprev
+        moving = (v * v).sum(-1) > self.sleepTol**2
+        self.sleep[moving] = 0
+        self.sleep[~moving & (self.sleep < SLEEP_STEPS)] += 1
+
+        # sleeping particles keep their position and lose any velocity
+        free = self.fixed == 0
+        asleep = free & (self.sleep >= SLEEP_STEPS)
+        free &= ~asleep
+        self.Xprev[asleep] = self.X[asleep]
+        temp = self.X[free]
+        self.X[free] = (2 * temp) - self.Xprev[free] + (0, self.g)
+        self.Xprev[free] = temp
+
+    # relaxes every constraint between the particles in v and the matching
+    # particles in w at once, returning how far off the worst one was; v, w,
+    # sleepV and sleepW are views into self.X and self.sleep
     # https://owlree.blog/posts/simulating-a-rope.html
-    def relax_constraint(self, v, w, gap):
-        if v.fixed and w.fixed: return
-        r = w.x - v.x
-        r_mag = np.dot(r, r)**0.5
-        r_hat = r / r_mag
+    def relax_constraint(self, v, w, wV, wW, sleepV, sleepW, gap):
+        r = w - v
+        r_mag = np.sqrt((r * r).sum(-1, keepdims=True))
         delta = r_mag - gap
-        k = (1 - (1 - self.stiffness)**JAKOBSEN_ITERATIONS)
-        if v.fixed:
-            w.x -= (k / w.m) * delta * r_hat
-        elif w.fixed:
-            v.x += (k / v.m) * delta * r_hat
-        else:
-            v.x += (k / v.m) * (delta / 2) * r_hat
-            w.x -= (k / w.m) * (delta / 2) * r_hat
-
+        wake = (np.abs(delta) > self.wakeTol * gap)[..., 0]
+        wake &= (sleepV < SLEEP_STEPS) | (sleepW < SLEEP_STEPS)
+        sleepV[wake] = 0
+        sleepW[wake] = 0
+
+        # each end moves in proportion to its inverse mass, or not at all
+        # while it is asleep; constraints where neither end can move have
+        # s == 0 and are left alone
+        wV = np.where((sleepV < SLEEP_STEPS)[..., None], wV, 0)
+        wW = np.where((sleepW < SLEEP_STEPS)[..., None], wW, 0)
+        s = wV + wW
+        factor = np.zeros_like(s)
+        np.divide(self.k * delta, s * r_mag, out=factor, where=s != 0)
+        v += factor * wV * r
+        w -= factor * wW * r
+        return np.abs(delta[s != 0]).max(initial=0)
 
     def jakobsen(self):
-        rows = len(self.particles)
-        cols = len(self.particles[0])
-        for _ in range(JAKOBSEN_ITERATIONS):
+        X, W, sleep = self.X, self.W, self.sleep
+        if _cloth is not None:
+            _cloth.jakobsen(X.reshape(-1, 2), W.reshape(-1), sleep.reshape(-1),
+                            self.colorEdges, self.colorGaps, self.k, JAKOBSEN_ITERATIONS,
+                            self.convergeTol, self.wakeTol, SLEEP_STEPS)
+            return
+        if njit is not None:
+            _jakobsen(X.reshape(-1, 2), W.reshape(-1), sleep.reshape(-1),
+                      self.colorEdges, self.colorGaps, self.k, JAKOBSEN_ITERATIONS,
+                      self.convergeTol, self.wakeTol, SLEEP_STEPS)
+            return
 
-            # vertical
-            for i in range(rows - 1):
-                for j in range(cols):
-                    v = self.particles[i][j]
-                    w = self.particles[i+1][j]
-                    self.relax_constraint(v, w, self.yGap)
-
-            # horizontal
-            for i in range(rows):
-                for j in range(cols - 1):
-                    v = self.particles[i][j]
-                    w = self.particles[i][j+1]
-                    self.relax_constraint(v, w, self.xGap)
+        for _ in range(JAKOBSEN_ITERATIONS):
+            maxErr = 0
+            for v, w, gap in self.colors:
+                err = self.relax_constraint(X[v], X[w], W[v], W[w],
+                                            sleep[v], sleep[w], gap)
+                maxErr = max(maxErr, err)
+            if maxErr < self.convergeTol: break
 
 def onAppStart(app):
     app.width, app.height = 600, 600
@@ -187,10 +304,15 @@ def redrawAll(app):
         if app.points >= 2:
             x2, y2 = app.clothPoint2
             drawCircle(float(x2), float(y2), 5, fill='blue')
-            drawLine(float(x1), float(y1), float(x2), float(y1))
-            drawLine(float(x1), float(y1), float(x1), float(y2))
-            drawLine(float(x2), float(y1), float(x2), float(y2))
-            drawLine(float(x1), float(y2), float(x2), float(y2))
+
+            # the outline is one rectangle, unless the corners line up and
+            # it has no area to draw
+            left, top = float(min(x1, x2)), float(min(y1, y2))
+            width, height = float(abs(x2 - x1)), float(abs(y2 - y1))
+            if width > 0 and height > 0:
+                drawRect(left, top, width, height, fill=None, border='black')
+            else:
+                drawLine(float(x1), float(y1), float(x2), float(y2))
     
     drawLabel(f"Number of Cloth Points: {app.clothPoints}", 25, 25, size=20, align='left')
 
@@ -240,7 +362,6 @@ def onStep(app):
     if app.paused: return
     
     if app.cloth != None:
-        app.cloth.add_gravity()
         app.cloth.update()
         app.cloth.jakobsen()
 
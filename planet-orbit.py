@@ -9,58 +9,192 @@ VELOCITY_NORM = 0.25
 FPS = 100
 DT = 1/FPS
 
+# with at least BARNES_HUT_PLANETS planets, gravity is worked out with a
+# quadtree, where a group of planets pulls as one body once its width is
+# less than THETA times its distance
+BARNES_HUT_PLANETS = 200
+THETA = 0.5
+
 # creates vectors
 def vec(x, y):
     return np.array([x, y])
 
-class Planet:
+# quadtree over the planets, where every node covers a square and holds
+# the total mass and center of mass of the planets inside it, and every
+# leaf holds exactly one planet
+# https://en.wikipedia.org/wiki/Barnes%E2%80%93Hut_simulation
+class QuadTree:
+
+    # planets closer together than this many halvings of the root square
+    # are split into two groups arbitrarily instead of by quadrant
+    MAX_DEPTH = 32
+
+    def __init__(self, x, m):
+        self.mass = []
+        self.com = []
+        self.size = []
+        self.children = []
+        self.planet = []
+
+        low, high = x.min(0), x.max(0)
+        size = float((high - low).max()) or 1.0
+        self.build(x.tolist(), m.ravel().tolist(), list(range(len(x))),
+                   float(low[0]), float(low[1]), size, 0)
+
+        self.mass = np.array(self.mass)
+        self.com = np.array(self.com)
+        self.size = np.array(self.size)
+        self.children = np.array(self.children, dtype=int)
+        self.planet = np.array(self.planet, dtype=int)
+
+    # adds the node for the planets in indices, inside the square with its
+    # top left corner at (left, top), and returns the node's index
+    def build(self, x, m, indices, left, top, size, depth):
+        node = len(self.mass)
+        self.mass.append(None)
+        self.com.append(None)
+        self.size.append(size)
+        self.children.append([-1] * 4)
+        self.planet.append(-1)
+
+        if len(indices) == 1:
+            i = indices[0]
+            self.mass[node] = m[i]
+            self.com[node] = x[i]
+            self.planet[node] = i
+            return node
+
+        half = size / 2
+        if depth < QuadTree.MAX_DEPTH:
+            groups = [[], [], [], []]
+            for i in indices:
+                right = x[i][0] >= left + half
+                bottom = x[i][1] >= top + half
+                groups[2*bottom + right].append(i)
+            corners = [(left, top), (left + half, top),
+                       (left, top + half), (left + half, top + half)]
+            childSize = half
+        else:
+            groups = [indices[:len(indices)//2], indices[len(indices)//2:]]
+            corners = [(left, top), (left, top)]
+            childSize = size
+
+        mass, comX, comY = 0, 0, 0
+        for k in range(len(groups)):
+            if len(groups[k]) == 0: continue
+            child = self.build(x, m, groups[k], corners[k][0], corners[k][1],
+                               childSize, depth + 1)
+            self.children[node][k] = child
+            mass += self.mass[child]
+            comX += self.mass[child] * self.com[child][0]
+            comY += self.mass[child] * self.com[child][1]
+        self.mass[node] = mass
+        self.com[node] = [comX / mass, comY / mass]
+        return node
+
+    # returns the gravity on every planet, walking the tree for all of them
+    # at once as pairs of a planet and a node; a node that holds the planet
+    # itself is never far enough away to be used whole, since THETA < 1/sqrt(2)
+    def gravity(self, x, m):
+        f = np.zeros_like(x)
+        planets = np.arange(len(x))
+        nodes = np.zeros(len(x), dtype=int)
+        while len(planets) > 0:
+            d = self.com[nodes] - x[planets]
+            d_squared = (d * d).sum(-1)
+
+            # a planet does not pull on itself
+            leaf = self.planet[nodes] >= 0
+            keep = self.planet[nodes] != planets
+            planets, nodes = planets[keep], nodes[keep]
+            d, d_squared, leaf = d[keep], d_squared[keep], leaf[keep]
 
-    def __init__(self, x, v, m, r):
-        self.m = m
-        self.r = r
-        self.x = x
-        self.f = vec(0, 0)
+            use = leaf | (self.size[nodes]**2 < THETA**2 * d_squared)
+            p, n = planets[use], nodes[use]
+            f_g = G * m[p, 0] * self.mass[n] * d_squared[use] ** -1.5
+            f[:, 0] += np.bincount(p, f_g * d[use, 0], minlength=len(x))
+            f[:, 1] += np.bincount(p, f_g * d[use, 1], minlength=len(x))
+
+            # every other node is opened up into its children
+            children = self.children[nodes[~use]]
+            planets = np.repeat(planets[~use], 4)
+            nodes = children.ravel()
+            planets, nodes = planets[nodes >= 0], nodes[nodes >= 0]
+        return f
+
+# all planets, stored as arrays with one row per planet; the arrays are only
+# reallocated when a planet is added, every step updates them in place
+class Planets:
+
+    def __init__(self):
+        self.m = np.zeros((0, 1))
+        self.r = np.zeros(0)
+        self.x = np.zeros((0, 2))
+        self.f = np.zeros((0, 2))
 
         # used for Euler integration
-        self.v = v
+        self.v = np.zeros((0, 2))
 
         # used for Verlet integration
-        self.xPrev = x - (v * DT)
+        self.xPrev = np.zeros((0, 2))
+
+    def __len__(self):
+        return len(self.x)
+
+    def add(self, x, v, m, r):
+        self.m = np.vstack([self.m, [m]])
+        self.r = np.append(self.r, r)
+        self.x = np.vstack([self.x, x])
+        self.f = np.vstack([self.f, vec(0, 0)])
+        self.v = np.vstack([self.v, v])
+        self.xPrev = np.vstack([self.xPrev, x - (v * DT)])
     
-    # updates position with Euler integration
+    # updates positions with Euler integration
     def euler_update(self):
         a = self.f / self.m
-        self.v = self.v + (a * DT)
+        self.v += a * DT
 
-        self.xPrev = self.x
-        self.x = self.x + (self.v * DT)
+        self.xPrev[:] = self.x
+        self.x += self.v * DT
 
-        self.f = vec(0, 0)
+        self.f.fill(0)
     
-    # updates position with Verlet integration
+    # updates positions with Verlet integration
     # https://en.wikipedia.org/wiki/Verlet_integration
     def verlet_update(self):
         a = self.f / self.m
-        temp = self.x 
-        self.x = (2 * self.x) - self.xPrev + (a * DT**2)
-        self.xPrev = temp
 
-        self.v = (self.x - self.xPrev) / DT
-        self.f = vec(0, 0)
+        # the new positions are written over the old previous positions,
+        # then the two arrays swap places
+        self.xPrev *= -1
+        self.xPrev += (2 * self.x) + (a * DT**2)
+        self.x, self.xPrev = self.xPrev, self.x
+
+        np.subtract(self.x, self.xPrev, out=self.v)
+        self.v /= DT
+        self.f.fill(0)
     
-    # adds gravity between 2 planets
-    @staticmethod
-    def add_gravity(p1, p2):
-        d = p2.x - p1.x
-        d_squared = np.dot(d, d)
-        d_hat = d / (d_squared ** 0.5)
-        f_g = G * p1.m * p2.m / d_squared
-        p1.f = p1.f + (f_g * d_hat)
-        p2.f = p2.f - (f_g * d_hat)
+    # adds gravity between every pair of planets at once
+    def add_gravity(self):
+        if len(self) >= BARNES_HUT_PLANETS:
+            self.f += QuadTree(self.x, self.m).gravity(self.x, self.m)
+            return
+
+        # d[i, j] points from planet i to planet j
+        d = self.x[None, :, :] - self.x[:, None, :]
+        d_squared = (d * d).sum(-1)
+
+        # a planet does not pull on itself
+        np.fill_diagonal(d_squared, 1)
+        inv = d_squared ** -1.5
+        np.fill_diagonal(inv, 0)
+
+        f_g = G * (self.m * self.m.T) * inv
+        self.f += (f_g[..., None] * d).sum(axis=1)
 
     def draw(self):
-        x, y = self.x
-        drawCircle(float(x), float(y), self.r)
+        for (x, y), r in zip(self.x.tolist(), self.r.tolist()):
+            drawCircle(x, y, r)
 
 def onAppStart(app):
     app.width, app.height = 600, 600
@@ -70,7 +204,7 @@ def onAppStart(app):
     reset(app)
 
 def reset(app):
-    app.planets = []
+    app.planets = Planets()
     resetNewPlanet(app)
 
 def resetNewPlanet(app):
@@ -79,8 +213,7 @@ def resetNewPlanet(app):
     app.newPlanetVelX, app.newPlanetVelY = None, None
 
 def redrawAll(app):
-    for planet in app.planets:
-        planet.draw()
+    app.planets.draw()
 
     if app.newPlanetX != None:
         drawCircle(app.newPlanetX, app.newPlanetY, app.newPlanetR, fill='blue')
@@ -103,7 +236,7 @@ def onMousePress(app, mouseX, mouseY):
         planetV = VELOCITY_NORM * (vec(app.newPlanetVelX, app.newPlanetVelY) - planetX)
         planetA = math.pi * app.newPlanetR**2
         planetM = PLANET_DENSITY * planetA
-        app.planets.append(Planet(planetX, planetV, planetM, app.newPlanetR))
+        app.planets.add(planetX, planetV, planetM, app.newPlanetR)
         resetNewPlanet(app)
 
 def onMouseMove(app, mouseX, mouseY):
@@ -121,22 +254,18 @@ def onKeyPress(app, key):
         demo_config(app)
 
 def demo_config(app):
-    planet1 = Planet(vec(230, 300), vec(0, 65), 250, 30)
-    planet2 = Planet(vec(370, 300), vec(0, -65), 250, 30)
-    app.planets = [planet1, planet2]
+    app.planets = Planets()
+    app.planets.add(vec(230, 300), vec(0, 65), 250, 30)
+    app.planets.add(vec(370, 300), vec(0, -65), 250, 30)
 
 def onStep(app):
     if app.paused: return
 
-    for i in range(len(app.planets)-1):
-        for j in range(i+1, len(app.planets)):
-            Planet.add_gravity(app.planets[i], app.planets[j])
-
-    for planet in app.planets:
-        if app.euler:
-            planet.euler_update()
-        else: 
-            planet.verlet_update()
+    app.planets.add_gravity()
+    if app.euler:
+        app.planets.euler_update()
+    else: 
+        app.planets.verlet_update()
 
 def main():
     runApp()
@@ -1,5 +1,6 @@
 from cmu_graphics import *
 import numpy as np
+import math
 
 # constants
 G = 1000
@@ -12,56 +13,65 @@ def vec(x, y):
     return np.array([x, y])
 
 def distance(x1, x2):
-    r = x2 - x1
-    return np.dot(r, r)**0.5
+    return math.hypot(x2[0] - x1[0], x2[1] - x1[1])
 
+# positions and forces are kept as plain floats, since numpy arrays
+# of 2 elements cost far more to create and combine than they save
 class Particle:
 
-    def __init__(self, x, r, m):
+    def __init__(self, x, y, r, m):
         self.m = m
         self.r = r
-        self.x = x
-        self.xPrev = x
-        self.f = vec(0, 0)
+        self.x, self.y = x, y
+        self.xPrev, self.yPrev = x, y
+        self.fx, self.fy = 0.0, 0.0
         self.fixed = False
 
+        # 0 while the particle is fixed, so it takes no constraint correction
+        self.invM = 1 / m
+
     # https://en.wikipedia.org/wiki/Verlet_integration
     def update(self):
-        a = self.f / self.m
-        temp = self.x 
-        self.x = (2 * self.x) - self.xPrev + (a * DT**2)
-        self.xPrev = temp
+        ax, ay = self.fx / self.m, self.fy / self.m
+        newX = (2 * self.x) - self.xPrev + (ax * DT**2)
+        newY = (2 * self.y) - self.yPrev + (ay * DT**2)
+        self.xPrev, self.yPrev = self.x, self.y
+        self.x, self.y = newX, newY
 
-        self.v = (self.x - self.xPrev) / DT
-        self.f = vec(0, 0)
+        self.fx, self.fy = 0.0, 0.0
 
     def add_gravity(self):
-        gVec = self.m * G * vec(0, 1)
-        self.f += gVec
+        self.fy += self.m * G
 
     def draw(self):
-        x, y = float(self.x[0]), float(self.x[1])
-        drawCircle(x, y, self.r)
+        drawCircle(self.x, self.y, self.r)
 
 class Rope:
 
     def __init__(self, start, end, num_particles, r, m, stiffness):
         length = distance(start, end)
         unitStride = (end - start) / length
-        self.gap = length / (num_particles - 1)
+        self.gap = length / max(num_particles - 1, 1)
         
         self.particles = []
         for i in range(num_particles):
-            pos = start + (i * self.gap * unitStride) 
-            self.particles.append(Particle(pos, r, m))
+            posX, posY = start + (i * self.gap * unitStride) 
+            self.particles.append(Particle(float(posX), float(posY), r, m))
         self.stiffness = stiffness
 
+        # fraction of the error corrected per iteration, the same for every
+        # constraint, so it is worked out once here; corrections have always
+        # been scaled by 1/m, and every particle has the same mass, so that
+        # is folded in too
+        self.k = (1 - (1 - stiffness)**JAKOBSEN_ITERATIONS) / m
+
     def closest(self, x):
+        x, y = float(x[0]), float(x[1])
         minDist = None
         minI = None
         for i in range(len(self.particles)):
             particle = self.particles[i]
-            dist = distance(x, particle.x)
+            dist = (particle.x - x)**2 + (particle.y - y)**2
             if minDist == None or dist < minDist:
                 minDist = dist
                 minI = i
@@ -69,20 +79,22 @@ class Rope:
     
     def setFixed(self, i):
         if i < 0 or i >= len(self.particles): return
-        self.particles[i].fixed = not self.particles[i].fixed
+        particle = self.particles[i]
+        particle.fixed = not particle.fixed
+        particle.invM = 0 if particle.fixed else 1 / particle.m
 
     def setPosition(self, i, pos):
         if i < 0 or i >= len(self.particles): return
-        self.particles[i].x = pos
+        self.particles[i].x, self.particles[i].y = float(pos[0]), float(pos[1])
     
     def draw(self):
         for particle in self.particles:
             if particle.fixed: particle.draw()
 
         for i in range(len(self.particles)-1):
-            startX, startY = self.particles[i].x
-            endX, endY = self.particles[i+1].x
-            drawLine(float(startX), float(startY), float(endX), float(endY))
+            v = self.particles[i]
+            w = self.particles[i+1]
+            drawLine(v.x, v.y, w.x, w.y)
 
     def add_gravity(self):
         for particle in self.particles:
@@ -96,23 +108,23 @@ class Rope:
 
     # https://owlree.blog/posts/simulating-a-rope.html
     def jakobsen(self):
+        k = self.k
         for _ in range(JAKOBSEN_ITERATIONS):
             for i in range(len(self.particles)-1):
                 v = self.particles[i]
                 w = self.particles[i+1]
-                if v.fixed and w.fixed: continue  
-                r = w.x - v.x
-                r_mag = np.dot(r, r)**0.5
-                r_hat = r / r_mag
-                delta = r_mag - self.gap
-                k = (1 - (1 - self.stiffness)**JAKOBSEN_ITERATIONS)
-                if v.fixed:
-                    w.x -= (k / w.m) * delta * r_hat
-                elif w.fixed:
-                    v.x += (k / v.m) * delta * r_hat
-                else:
-                    v.x += (k / v.m) * (delta / 2) * r_hat
-                    w.x -= (k / w.m) * (delta / 2) * r_hat
+                s = v.invM + w.invM
+                if s == 0: continue
+
+                # each end moves in proportion to its inverse mass
+                dx = w.x - v.x
+                dy = w.y - v.y
+                r_mag = math.sqrt(dx*dx + dy*dy)
+                factor = k * (r_mag - self.gap) / (s * r_mag)
+                v.x += factor * v.invM * dx
+                v.y += factor * v.invM * dy
+                w.x -= factor * w.invM * dx
+                w.y -= factor * w.invM * dy
 
 def onAppStart(app):
     app.width, app.height = 600, 600
@@ -127,6 +139,20 @@ def reset(app):
     app.ropePoint1 = None
     app.ropePoint2 = None
     app.ropePoints = 20
+    app.ropePreview = []
+
+# works out where the points between the two ends of the rope preview go,
+# so redrawAll does not have to every frame
+def updatePreview(app):
+    if app.points < 2:
+        app.ropePreview = []
+        return
+    x1, y1 = app.ropePoint1
+    x2, y2 = app.ropePoint2
+    n = max(app.ropePoints, 2)
+    xs = np.linspace(x1, x2, n)[1:-1]
+    ys = np.linspace(y1, y2, n)[1:-1]
+    app.ropePreview = list(zip(xs.tolist(), ys.tolist()))
 
 def redrawAll(app):
     if app.rope != None:
@@ -140,10 +166,8 @@ def redrawAll(app):
             x2, y2 = app.ropePoint2
             drawCircle(float(x2), float(y2), 5, fill='blue')
             drawLine(float(x1), float(y1), float(x2), float(y2))
-            xStride = (x2 - x1) / (app.ropePoints - 1)
-            yStride = (y2 - y1) / (app.ropePoints - 1)
-            for i in range(1, app.ropePoints-1):
-                drawCircle(float(x1 + i*xStride), float(y1 + i*yStride), 3, fill='blue')
+            for x, y in app.ropePreview:
+                drawCircle(x, y, 3, fill='blue')
 
     
     drawLabel(f"Number of Rope Points: {app.ropePoints}", 25, 25, size=20, align='left')
@@ -159,8 +183,10 @@ def onKeyPress(app, key):
         reset(app)
     elif key == 'up':
         app.ropePoints += 1
+        updatePreview(app)
     elif key == 'down':
         app.ropePoints -= 1
+        updatePreview(app)
     elif key == 'enter' and app.rope == None and app.points == 2:
         app.rope = Rope(app.ropePoint1, app.ropePoint2, app.ropePoints, 5, 5, 1)
 
@@ -172,6 +198,7 @@ def onMousePress(app, mouseX, mouseY, button):
         elif app.points == 1:
             app.ropePoint2 = vec(mouseX, mouseY)
             app.points += 1
+            updatePreview(app)
         elif app.rope != None:
             closestIndex = app.rope.closest(vec(mouseX, mouseY))
             app.rope.setFixed(closestIndex)
@@ -0,0 +1,18 @@
+# builds the optional Cython version of the cloth solver:
+#   python setup.py build_ext --inplace
+import sys
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+
+if sys.platform == 'win32':
+    compileArgs = ['/O2', '/fp:fast']
+else:
+    compileArgs = ['-O3', '-ffast-math', '-march=native']
+
+setup(
+    name='physics-demos',
+    ext_modules=cythonize(
+        [Extension('_cloth', ['_cloth.pyx'], extra_compile_args=compileArgs)],
+        language_level=3,
+    ),
+)